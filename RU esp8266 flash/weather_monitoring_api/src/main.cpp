@@ -11,8 +11,14 @@ const char* serverURL = "ip вашего сервера/api/data";
 
 GyverBME280 bme;
 
+// Ключ идемпотентности: случайный id загрузки + номер измерения, одинаков для всех повторов
+String bootId;
+unsigned long readingCounter = 0;
+const int maxAttempts = 3;
+
 void setup() {
   Serial.begin(115200);
+  bootId = String(ESP.random(), HEX);
   
   // Инициализация датчика
   if (!bme.begin()) {
@@ -43,14 +49,21 @@ void loop() {
                   ",\"pressure\":" + String(p, 1) + 
                   ",\"device_id\":\"esp8266\"}";
 
-    http.begin(client, serverURL);
-    http.addHeader("Content-Type", "application/json");
-    
-    int code = http.POST(json);
-    Serial.print("Код ответа: ");
-    Serial.println(code);
-    
-    http.end();
+    String key = bootId + "-" + String(readingCounter++);
+
+    for (int attempt = 0; attempt < maxAttempts; attempt++) {
+      http.begin(client, serverURL);
+      http.addHeader("Content-Type", "application/json");
+      http.addHeader("Idempotency-Key", key);
+
+      int code = http.POST(json);
+      Serial.print("Код ответа: ");
+      Serial.println(code);
+
+      http.end();
+      if (code > 0) break; // Повторяем только при ошибке соединения
+      delay(1000);
+    }
   }
   
   delay(300000); // Ждем 5 минут
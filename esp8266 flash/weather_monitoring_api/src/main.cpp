@@ -12,8 +12,14 @@ const char* serverURL = "your ip/api/data";
 
 GyverBME280 bme;
 
+// Idempotency key: random boot id + reading counter, same for all retries of one reading
+String bootId;
+unsigned long readingCounter = 0;
+const int maxAttempts = 3;
+
 void setup() {
   Serial.begin(115200);
+  bootId = String(ESP.random(), HEX);
   
   // Sensor initialization
   if (!bme.begin()) {
@@ -44,14 +50,21 @@ void loop() {
                   ",\"pressure\":" + String(p, 1) + 
                   ",\"device_id\":\"esp8266\"}";
 
-    http.begin(client, serverURL);
-    http.addHeader("Content-Type", "application/json");
-    
-    int code = http.POST(json);
-    Serial.print("Response code: ");
-    Serial.println(code);
-    
-    http.end();
+    String key = bootId + "-" + String(readingCounter++);
+
+    for (int attempt = 0; attempt < maxAttempts; attempt++) {
+      http.begin(client, serverURL);
+      http.addHeader("Content-Type", "application/json");
+      http.addHeader("Idempotency-Key", key);
+
+      int code = http.POST(json);
+      Serial.print("Response code: ");
+      Serial.println(code);
+
+      http.end();
+      if (code > 0) break; // Retry only on connection errors
+      delay(1000);
+    }
   }
   
   delay(300000); // Wait 5 minutes
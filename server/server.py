@@ -4,8 +4,15 @@ from flask import Flask, request, jsonify, send_from_directory
 import sqlite3
 from datetime import datetime, timedelta
 from flask_cors import CORS
+from collections import OrderedDict
+import gzip
+import hmac
 import math
 import os
+import shutil
+import sys
+import threading
+import time
 
 app = Flask(__name__)
 CORS(app)
@@ -16,19 +23,87 @@ api_calls = {
     'current': 0, 
     'history': 0,
     'forecast': 0,
-    'simple_chart': 0
+    'simple_chart': 0,
+    'series': 0
 }
 
 # File for storing visit statistics
 VISITS_FILE = 'visits.txt'
 
+# Database file
+DB_FILE = 'meteo.db'
+
+# Station altitude in meters (used for sea-level pressure).
+# While it is None sea-level pressure is not stored, after setting it run
+# python server.py recompute sea_level_pressure
+STATION_ALTITUDE = None
+
+# Rows updated per batch when backfilling derived metrics
+BACKFILL_BATCH_SIZE = 500
+
+# Per-device rate limit (token bucket): burst size and refill rate in posts per second
+RATE_LIMIT_BURST = 5
+RATE_LIMIT_RATE = 0.1
+
+# Client address bucket is this many times larger, so a client cannot
+# get around the limit by sending a new device_id with every post
+RATE_LIMIT_ADDRESS_FACTOR = 10
+
+# Number of rate limit buckets kept in memory
+RATE_LIMIT_BUCKETS_SIZE = 1000
+
+# Number of recent idempotency keys kept in memory
+RECENT_KEYS_SIZE = 1000
+
+# Default and maximum number of points returned by /api/series
+SERIES_DEFAULT_POINTS = 500
+SERIES_MAX_POINTS = 5000
+
+# Ids per query when fetching rows picked by downsampling
+SERIES_FETCH_BATCH_SIZE = 500
+
+# Online backup settings: output directory, pages copied per step
+# and pause between steps so writers can get the lock
+BACKUP_DIR = 'backups'
+BACKUP_PAGES_PER_STEP = 64
+BACKUP_STEP_SLEEP = 0.01
+# Seconds to wait for inserts that overlapped the copy before reporting
+BACKUP_WRITE_WAIT = 5
+# Number of newest snapshots kept, older ones are deleted after a backup
+BACKUP_KEEP = 7
+# Token for POST /api/backup (X-Backup-Token header). While it is None the
+# endpoint only accepts requests from localhost, set it when behind a proxy
+BACKUP_TOKEN = None
+
+# Ingest protection counters
+ingest_stats = {
+    'rate_limited': 0,
+    'duplicates_cache': 0,
+    'duplicates_db': 0
+}
+
+ingest_lock = threading.Lock()
+rate_buckets = OrderedDict()
+recent_keys = OrderedDict()
+
+backup_lock = threading.Lock()
+backup_state = {
+    'running': False,
+    'writes': 0,
+    'pending_writes': 0,
+    'max_writer_stall_ms': 0
+}
+backup_writes_done = threading.Condition(ingest_lock)
+
 def get_db_connection():
-    conn = sqlite3.connect('meteo.db', check_same_thread=False)
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     return conn
 
 def init_db():
     conn = get_db_connection()
+    # WAL lets readers (including online backup) run without blocking ingest
+    conn.execute('PRAGMA journal_mode=WAL')
     conn.execute('''
         CREATE TABLE IF NOT EXISTS weather_data (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,8 +113,27 @@ def init_db():
             timestamp TEXT NOT NULL
         )
     ''')
+    # Add columns registered after the table was created
+    extra_columns = {'device_id': 'TEXT', 'idempotency_key': 'TEXT'}
+    extra_columns.update({name: 'REAL' for name in DERIVED_METRICS})
+    existing_columns = {row['name'] for row in conn.execute('PRAGMA table_info(weather_data)')}
+    for name, column_type in extra_columns.items():
+        if name not in existing_columns:
+            conn.execute(f'ALTER TABLE weather_data ADD COLUMN {name} {column_type}')
+    added_metrics = [name for name in DERIVED_METRICS if name not in existing_columns]
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_weather_data_idempotency_key
+        ON weather_data (idempotency_key)
+        WHERE idempotency_key IS NOT NULL
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_weather_data_timestamp ON weather_data (timestamp)')
     conn.commit()
+    # Only new metrics are filled here, stale values are recomputed with
+    # python server.py recompute
+    backfilled = backfill_derived_metrics(conn, names=added_metrics) if added_metrics else 0
     conn.close()
+    if backfilled:
+        print(f"Derived metrics backfilled for {backfilled} rows")
     print("Database initialized!")
 
 # Function to initialize visits file
@@ -99,6 +193,296 @@ def calculate_feels_like(temperature, humidity):
     
     return round(feels_like, 1)
 
+# Function to calculate dew point (Magnus formula)
+def calculate_dew_point(temperature, humidity):
+    """
+    Calculates dew point in °C using Magnus formula
+    """
+    a = 17.62
+    b = 243.12
+    gamma = math.log(max(humidity, 0.1) / 100) + a * temperature / (b + temperature)
+    return round(b * gamma / (a - gamma), 1)
+
+# Function to calculate absolute humidity
+def calculate_absolute_humidity(temperature, humidity):
+    """
+    Calculates absolute humidity in g/m³
+    """
+    saturation_pressure = 6.112 * math.exp(17.67 * temperature / (temperature + 243.5))
+    absolute_humidity = saturation_pressure * humidity * 2.1674 / (273.15 + temperature)
+    return round(absolute_humidity, 1)
+
+# Function to calculate pressure reduced to sea level
+def calculate_sea_level_pressure(temperature, pressure):
+    """
+    Reduces station pressure to sea level using barometric formula
+    Pressure is in mmHg, altitude is taken from STATION_ALTITUDE
+    Returns None while altitude is not configured
+    """
+    if STATION_ALTITUDE is None:
+        return None
+    h = STATION_ALTITUDE
+    sea_level_pressure = pressure * (1 - 0.0065 * h / (temperature + 0.0065 * h + 273.15)) ** -5.257
+    return round(sea_level_pressure, 1)
+
+# Derived metrics registry: column name -> function of a reading.
+# Metrics are computed once at ingest time and stored as columns,
+# new metrics only need to be added here.
+DERIVED_METRICS = {
+    'feels_like': lambda r: calculate_feels_like(r['temperature'], r['humidity']),
+    'dew_point': lambda r: calculate_dew_point(r['temperature'], r['humidity']),
+    'absolute_humidity': lambda r: calculate_absolute_humidity(r['temperature'], r['humidity']),
+    'sea_level_pressure': lambda r: calculate_sea_level_pressure(r['temperature'], r['pressure']),
+}
+
+def compute_derived_metrics(reading):
+    return {name: func(reading) for name, func in DERIVED_METRICS.items()}
+
+# Function to insert readings together with their derived metrics
+def insert_readings(conn, readings):
+    columns = ['temperature', 'humidity', 'pressure', 'timestamp', 'device_id', 'idempotency_key'] + list(DERIVED_METRICS)
+    placeholders = ', '.join('?' for _ in columns)
+    rows = []
+    for reading in readings:
+        row = dict(reading, **compute_derived_metrics(reading))
+        rows.append(tuple(row.get(column) for column in columns))
+    conn.executemany(f'INSERT INTO weather_data ({", ".join(columns)}) VALUES ({placeholders})', rows)
+
+# Function to fill derived metrics for rows stored before they existed
+def backfill_derived_metrics(conn, names=None, force=False):
+    """
+    Fills NULL values of derived metrics (all registered by default).
+    With force recomputes every row, e.g. after changing a formula or STATION_ALTITUDE
+    """
+    names = list(names or DERIVED_METRICS)
+    missing = ' OR '.join(f'{name} IS NULL' for name in names) if not force else '1'
+    assignments = ', '.join(f'{name} = ?' for name in names)
+    total = 0
+    last_id = 0
+    # Page by id so every row is visited once, even if a metric stays NULL (NaN)
+    while True:
+        rows = conn.execute(f'''
+            SELECT id, temperature, humidity, pressure FROM weather_data
+            WHERE id > ? AND ({missing})
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, BACKFILL_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        updates = [tuple(DERIVED_METRICS[name](row) for name in names) + (row['id'],) for row in rows]
+        conn.executemany(f'UPDATE weather_data SET {assignments} WHERE id = ?', updates)
+        conn.commit()
+        total += len(rows)
+        last_id = rows[-1]['id']
+    return total
+
+# Function to take a token from both the device's and the client address's bucket
+def allow_request(device_id, address):
+    now = time.monotonic()
+    limits = {
+        ('device', device_id): (RATE_LIMIT_BURST, RATE_LIMIT_RATE),
+        ('address', address): (RATE_LIMIT_BURST * RATE_LIMIT_ADDRESS_FACTOR,
+                               RATE_LIMIT_RATE * RATE_LIMIT_ADDRESS_FACTOR)
+    }
+    with ingest_lock:
+        buckets = {}
+        for key, (burst, rate) in limits.items():
+            tokens, last = rate_buckets.get(key, (burst, now))
+            buckets[key] = min(burst, tokens + (now - last) * rate)
+        allowed = all(tokens >= 1 for tokens in buckets.values())
+        for key, tokens in buckets.items():
+            rate_buckets[key] = (tokens - 1 if allowed else tokens, now)
+            rate_buckets.move_to_end(key)
+        while len(rate_buckets) > RATE_LIMIT_BUCKETS_SIZE:
+            rate_buckets.popitem(last=False)
+        return allowed
+
+# Function to build idempotency key from header, body or (device, device_timestamp)
+def get_idempotency_key(data, device_id):
+    key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    if key:
+        return f"{device_id}:{key}"
+    if data.get('device_timestamp') is not None:
+        return f"{device_id}@{data['device_timestamp']}"
+    return None
+
+# Function to check recently seen idempotency keys
+def is_recent_key(key):
+    with ingest_lock:
+        if key in recent_keys:
+            recent_keys.move_to_end(key)
+            return True
+        return False
+
+def remember_key(key):
+    with ingest_lock:
+        recent_keys[key] = True
+        recent_keys.move_to_end(key)
+        while len(recent_keys) > RECENT_KEYS_SIZE:
+            recent_keys.popitem(last=False)
+
+def count_ingest(name):
+    with ingest_lock:
+        ingest_stats[name] += 1
+
+# Function to parse time parameter to naive local time, like stored timestamps
+def parse_local_time(value):
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+# Function to downsample a series with Largest-Triangle-Three-Buckets
+def downsample_lttb(points, threshold):
+    """
+    Reduces list of (x, y, id) points to threshold points,
+    keeping the ones that form the largest triangles (peaks and troughs)
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return points
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        # Average of the next bucket is the third vertex of the triangle
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_count = next_end - end
+        avg_x = sum(p[0] for p in points[end:next_end]) / next_count
+        avg_y = sum(p[1] for p in points[end:next_end]) / next_count
+
+        ax, ay = points[a][0], points[a][1]
+        max_area = -1
+        max_index = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                max_index = j
+
+        sampled.append(points[max_index])
+        a = max_index
+
+    sampled.append(points[-1])
+    return sampled
+
+# Function to mark start of an insert, returns True if backup is running
+def begin_write():
+    with ingest_lock:
+        if backup_state['running']:
+            backup_state['pending_writes'] += 1
+            return True
+        return False
+
+# Function to record how long an insert took if it overlapped the backup
+def record_writer_stall(seconds, started_during_backup):
+    with ingest_lock:
+        if started_during_backup:
+            backup_state['pending_writes'] -= 1
+            backup_writes_done.notify_all()
+        if started_during_backup or backup_state['running']:
+            backup_state['writes'] += 1
+            backup_state['max_writer_stall_ms'] = max(backup_state['max_writer_stall_ms'], seconds * 1000)
+
+# Function to delete old snapshots, keeping BACKUP_KEEP newest
+def prune_backups():
+    # Names contain the creation time, so sorting them sorts by age
+    snapshots = sorted(name for name in os.listdir(BACKUP_DIR)
+                       if name.startswith('meteo-') and name.endswith(('.db', '.db.gz')))
+    old = snapshots[:-BACKUP_KEEP] if BACKUP_KEEP > 0 else snapshots
+    for name in old:
+        os.remove(os.path.join(BACKUP_DIR, name))
+    return len(old)
+
+# Function to make consistent snapshot of the live database
+def backup_database(compress=False):
+    """
+    Copies meteo.db with SQLite online backup API in small page batches,
+    sleeping between steps so ingest is never blocked for long.
+    With compress the finished copy is then gzipped and the uncompressed
+    file removed, so disk space for both is needed while compressing.
+    Writer stall is measured on inserts made by this process during the copy,
+    it is None if there were none.
+    Returns None if another backup is already running
+    """
+    if not backup_lock.acquire(blocking=False):
+        return None
+
+    try:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        path = os.path.join(BACKUP_DIR, f"meteo-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db")
+
+        stats = {'steps': 0, 'pages': 0, 'max_step_ms': 0}
+        step_started = [time.perf_counter()]
+
+        def progress(status, remaining, total):
+            stats['steps'] += 1
+            stats['pages'] = total
+            stats['max_step_ms'] = max(stats['max_step_ms'], (time.perf_counter() - step_started[0]) * 1000)
+            # Yield to writers between steps
+            time.sleep(BACKUP_STEP_SLEEP)
+            step_started[0] = time.perf_counter()
+
+        with ingest_lock:
+            backup_state['running'] = True
+            backup_state['writes'] = 0
+            backup_state['max_writer_stall_ms'] = 0
+
+        started = time.perf_counter()
+        try:
+            source = get_db_connection()
+            target = sqlite3.connect(path)
+            try:
+                # Hold one read transaction for the whole copy so the snapshot is
+                # consistent and the backup is not restarted by concurrent inserts
+                source.isolation_level = None
+                source.execute('BEGIN')
+                source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+                source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+                source.execute('COMMIT')
+            finally:
+                target.close()
+                source.close()
+                elapsed = time.perf_counter() - started
+                with backup_writes_done:
+                    backup_state['running'] = False
+                    # Wait for inserts that started during the copy, they are
+                    # the ones most likely to have been held up
+                    backup_writes_done.wait_for(lambda: backup_state['pending_writes'] == 0, BACKUP_WRITE_WAIT)
+
+            if compress:
+                with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(path)
+                path += '.gz'
+        except BaseException:
+            # Don't leave half-written snapshots in the backup directory
+            for leftover in (path, path + '.gz'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            raise
+
+        size = os.path.getsize(path)
+        return {
+            'file': os.path.basename(path),
+            'size': size,
+            'pages': stats['pages'],
+            'steps': stats['steps'],
+            'seconds': round(elapsed, 3),
+            'pages_per_sec': round(stats['pages'] / elapsed, 1) if elapsed > 0 else None,
+            'max_step_ms': round(stats['max_step_ms'], 2),
+            'writes_during_backup': backup_state['writes'],
+            'max_writer_stall_ms': round(backup_state['max_writer_stall_ms'], 2) if backup_state['writes'] else None,
+            'removed_old_backups': prune_backups()
+        }
+    finally:
+        backup_lock.release()
+
 # Main page
 @app.route('/')
 def index():
@@ -114,6 +498,7 @@ def get_stats():
     return jsonify({
         'api_calls': api_calls,
         'total_api_calls': sum(api_calls.values()),
+        'ingest': ingest_stats,
         'total_visits': total_visits
     })
 
@@ -126,17 +511,57 @@ def receive_data():
     try:
         data = request.get_json()
         print(f"📨 Data from ESP #{api_calls['data']}: {data}")
+
+        device_id = data.get('device_id') or request.remote_addr
+
+        # Reject retries and floods before touching the database.
+        # Retries are checked first so they don't use up the device's tokens
+        idempotency_key = get_idempotency_key(data, device_id)
+        if idempotency_key and is_recent_key(idempotency_key):
+            count_ingest('duplicates_cache')
+            return jsonify({"status": "success", "message": "Duplicate ignored"}), 200
+
+        if not allow_request(device_id, request.remote_addr):
+            count_ingest('rate_limited')
+            return jsonify({"error": "Too many requests"}), 429
         
-        temperature = data.get('temperature')
-        humidity = data.get('humidity')
-        pressure = data.get('pressure')
+        # Derived metrics are calculated in Python, so readings must be numbers
+        try:
+            temperature = float(data['temperature'])
+            humidity = float(data['humidity'])
+            pressure = float(data['pressure'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": "temperature, humidity and pressure must be numbers"}), 400
+        if not all(math.isfinite(value) for value in (temperature, humidity, pressure)):
+            return jsonify({"error": "temperature, humidity and pressure must be finite"}), 400
         timestamp = datetime.now().isoformat()
 
         conn = get_db_connection()
-        conn.execute('INSERT INTO weather_data (temperature, humidity, pressure, timestamp) VALUES (?, ?, ?, ?)',
-                    (temperature, humidity, pressure, timestamp))
-        conn.commit()
-        conn.close()
+        started_during_backup = begin_write()
+        write_started = time.perf_counter()
+        try:
+            insert_readings(conn, [{
+                'temperature': temperature,
+                'humidity': humidity,
+                'pressure': pressure,
+                'timestamp': timestamp,
+                'device_id': device_id,
+                'idempotency_key': idempotency_key
+            }])
+            conn.commit()
+        except sqlite3.IntegrityError as e:
+            if 'UNIQUE' not in str(e):
+                raise
+            # Key is older than the in-memory cache, the unique index caught it
+            count_ingest('duplicates_db')
+            remember_key(idempotency_key)
+            return jsonify({"status": "success", "message": "Duplicate ignored"}), 200
+        finally:
+            conn.close()
+            record_writer_stall(time.perf_counter() - write_started, started_during_backup)
+
+        if idempotency_key:
+            remember_key(idempotency_key)
 
         return jsonify({"status": "success", "message": "Data saved"}), 201
     
@@ -150,17 +575,14 @@ def get_current_data():
     api_calls['current'] += 1
     
     conn = get_db_connection()
-    data = conn.execute('SELECT * FROM weather_data ORDER BY timestamp DESC LIMIT 1').fetchone()
+    columns = ['temperature', 'humidity', 'pressure'] + list(DERIVED_METRICS) + ['timestamp']
+    data = conn.execute(f'SELECT {", ".join(columns)} FROM weather_data ORDER BY timestamp DESC LIMIT 1').fetchone()
     conn.close()
 
     if data is None:
         return jsonify({"error": "No data available"}), 404
 
-    data_dict = dict(data)
-    # Add feels like temperature
-    data_dict['feels_like'] = calculate_feels_like(data_dict['temperature'], data_dict['humidity'])
-    
-    return jsonify(data_dict)
+    return jsonify(dict(data))
 
 # Simplified data for chart (4 points - every 30 minutes for the last 1.5 hours)
 @app.route('/api/simple_chart')
@@ -183,12 +605,7 @@ def get_simple_chart():
     if not data:
         return jsonify([])
 
-    # Convert data and add feels like temperature
-    all_data = []
-    for row in data:
-        row_dict = dict(row)
-        row_dict['feels_like'] = calculate_feels_like(row_dict['temperature'], row_dict['humidity'])
-        all_data.append(row_dict)
+    all_data = [dict(row) for row in data]
 
     # Create target time points with second precision
     now = datetime.now()
@@ -238,7 +655,7 @@ def get_simple_chart():
                 "temperature": closest_record['temperature'],
                 "humidity": closest_record['humidity'],
                 "pressure": closest_record['pressure'],
-                "feels_like": closest_record['feels_like'],
+                **{name: closest_record[name] for name in DERIVED_METRICS},
                 "full_timestamp": closest_record['timestamp'],
                 "seconds_ago": int((now - record_time).total_seconds())
             })
@@ -275,7 +692,7 @@ def get_simple_chart():
                     "temperature": record['temperature'],
                     "humidity": record['humidity'],
                     "pressure": record['pressure'],
-                    "feels_like": record['feels_like'],
+                    **{name: record[name] for name in DERIVED_METRICS},
                     "full_timestamp": record['timestamp'],
                     "seconds_ago": int(time_diff.total_seconds())
                 })
@@ -285,6 +702,60 @@ def get_simple_chart():
     
     return jsonify(chart_data)
 
+# Downsampled series for long-range charts
+@app.route('/api/series')
+def get_series():
+    global api_calls
+    api_calls['series'] += 1
+
+    metrics = ['temperature', 'humidity', 'pressure'] + list(DERIVED_METRICS)
+    metric = request.args.get('metric', 'temperature')
+    if metric not in metrics:
+        return jsonify({"error": f"Unknown metric: {metric}"}), 400
+
+    try:
+        to_time = parse_local_time(request.args['to']) if 'to' in request.args else datetime.now()
+        from_time = parse_local_time(request.args['from']) if 'from' in request.args else to_time - timedelta(days=1)
+        max_points = int(request.args.get('max_points', SERIES_DEFAULT_POINTS))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    max_points = max(3, min(max_points, SERIES_MAX_POINTS))
+
+    conn = get_db_connection()
+    # Downsample on plain (x, y, id) tuples, julianday() gives numeric x axis
+    # without parsing timestamps in Python
+    conn.row_factory = None
+    data = conn.execute(f'''
+        SELECT julianday(timestamp), {metric}, id
+        FROM weather_data
+        WHERE timestamp >= ? AND timestamp <= ? AND {metric} IS NOT NULL
+        ORDER BY timestamp
+    ''', (from_time.isoformat(), to_time.isoformat())).fetchall()
+    points = downsample_lttb(data, max_points)
+
+    # Fetch full rows only for the picked points
+    conn.row_factory = sqlite3.Row
+    columns = ['temperature', 'humidity', 'pressure'] + list(DERIVED_METRICS) + ['timestamp']
+    ids = [point[2] for point in points]
+    series = []
+    for i in range(0, len(ids), SERIES_FETCH_BATCH_SIZE):
+        batch = ids[i:i + SERIES_FETCH_BATCH_SIZE]
+        rows = conn.execute(f'''
+            SELECT {", ".join(columns)} FROM weather_data
+            WHERE id IN ({", ".join('?' for _ in batch)})
+        ''', batch).fetchall()
+        series.extend(dict(row) for row in rows)
+    conn.close()
+    series.sort(key=lambda x: x['timestamp'])
+
+    return jsonify({
+        "metric": metric,
+        "from": from_time.isoformat(),
+        "to": to_time.isoformat(),
+        "total_points": len(data),
+        "points": series
+    })
+
 # Data history
 @app.route('/api/history')
 def get_history():
@@ -292,22 +763,11 @@ def get_history():
     api_calls['history'] += 1
     
     conn = get_db_connection()
-    data = conn.execute('SELECT * FROM weather_data ORDER BY timestamp DESC LIMIT 24').fetchall()
+    columns = ['temperature', 'humidity', 'pressure'] + list(DERIVED_METRICS) + ['timestamp']
+    data = conn.execute(f'SELECT {", ".join(columns)} FROM weather_data ORDER BY timestamp DESC LIMIT 24').fetchall()
     conn.close()
 
-    history_list = []
-    for row in data:
-        row_dict = dict(row)
-        row_dict['feels_like'] = calculate_feels_like(row_dict['temperature'], row_dict['humidity'])
-        
-        history_list.append({
-            "temperature": row_dict['temperature'],
-            "humidity": row_dict['humidity'],
-            "pressure": row_dict['pressure'],
-            "feels_like": row_dict['feels_like'],
-            "timestamp": row_dict['timestamp']
-        })
-    
+    history_list = [dict(row) for row in data]
     history_list.reverse()
     return jsonify(history_list)
 
@@ -344,11 +804,36 @@ def get_forecast():
         "pressure_change": round(pressure_diff, 1)
     })
 
+# Online backup of the database
+@app.route('/api/backup', methods=['POST'])
+def create_backup():
+    if BACKUP_TOKEN:
+        allowed = hmac.compare_digest(request.headers.get('X-Backup-Token', ''), BACKUP_TOKEN)
+    else:
+        allowed = request.remote_addr in ('127.0.0.1', '::1')
+    if not allowed:
+        return jsonify({"error": "Forbidden"}), 403
+
+    compress = request.args.get('compress', '0').lower() in ('1', 'true', 'yes')
+    try:
+        result = backup_database(compress=compress)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    if result is None:
+        return jsonify({"error": "Backup already running"}), 409
+
+    print(f"💾 Backup created: {result['file']}")
+    return jsonify({"status": "success", **result}), 201
+
 # Reset statistics (for tests)
 @app.route('/api/reset_stats', methods=['DELETE'])
 def reset_stats():
     global api_calls
-    api_calls = {'data': 0, 'current': 0, 'history': 0, 'forecast': 0, 'simple_chart': 0}
+    api_calls = {'data': 0, 'current': 0, 'history': 0, 'forecast': 0, 'simple_chart': 0, 'series': 0}
+    with ingest_lock:
+        for name in ingest_stats:
+            ingest_stats[name] = 0
     # Also reset visit statistics
     write_visits(0)
     return jsonify({"status": "success", "message": "Statistics reset"})
@@ -362,7 +847,38 @@ def get_visits():
     })
 
 if __name__ == '__main__':
+    # Usage: python server.py backup [--compress]
+    if len(sys.argv) > 1 and sys.argv[1] == 'backup':
+        # Backup only reads the database, so init_db() is not run here.
+        # WAL is still needed so the backup read transaction doesn't block ingest
+        if not os.path.exists(DB_FILE):
+            print(f"Database {DB_FILE} not found")
+            sys.exit(1)
+        conn = get_db_connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.close()
+        result = backup_database(compress='--compress' in sys.argv)
+        if result is None:
+            print("Backup already running")
+            sys.exit(1)
+        # Ingest runs in the server process, so writer stall is only
+        # available from POST /api/backup
+        print(f"Backup created: {os.path.join(BACKUP_DIR, result['file'])} ({result['pages']} pages, "
+              f"{result['pages_per_sec']} pages/sec, longest step {result['max_step_ms']} ms)")
+        sys.exit(0)
     init_db()
+    # Usage: python server.py recompute [metric ...]
+    if len(sys.argv) > 1 and sys.argv[1] == 'recompute':
+        names = sys.argv[2:] or list(DERIVED_METRICS)
+        unknown = [name for name in names if name not in DERIVED_METRICS]
+        if unknown:
+            print(f"Unknown metrics: {', '.join(unknown)}")
+            sys.exit(1)
+        conn = get_db_connection()
+        recomputed = backfill_derived_metrics(conn, names=names, force=True)
+        conn.close()
+        print(f"Recomputed {', '.join(names)} for {recomputed} rows")
+        sys.exit(0)
     init_visits_file()
     print("Server started!")
     # Replace with these settings for production: